@@ -22,6 +22,18 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+
+# Prefer the C++ protobuf backend; parsing and iterating the node list of a
+# large GraphDef is an order of magnitude slower on the pure-Python backend.
+# The choice is latched when protobuf is first imported (the submodules below
+# import TensorFlow, which imports it), so this has to happen before any
+# submodule import and only takes effect if the user hasn't already picked a
+# backend. Only legacy protobuf 3.x honors this variable with a "cpp" value;
+# protobuf 4+ defaults to the upb backend, which is just as fast, and
+# ignores the setting.
+os.environ.setdefault("PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION", "cpp")
+
 # pylint: disable=wildcard-import
 from graph_def_editor.base_graph import *
 from graph_def_editor.edit import *
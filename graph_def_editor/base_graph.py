@@ -68,7 +68,17 @@ class BaseGraph(object):
     self._frozen = False  # bool
     self._next_id = 1  # int
     self._node_name_to_node = {}  # Dict[str, node.Node]; key is node name
+    # Lowercased names of all nodes, kept in sync with _node_name_to_node so
+    # the case-insensitive collision check in _name_in_use() is O(1).
+    self._node_names_lowercase = set()  # Set[str]
+    # Last suffix handed out by unique_name() for each colliding name, so
+    # repeated collisions on the same prefix don't re-probe from 1.
+    self._unique_name_counters = {}  # Dict[str, int]
     self._variable_name_to_variable = {}  # Dict[str, Variable]
+    # Memoized results of the nodes and tensors properties, each tagged with
+    # the version counter value it was computed under.
+    self._nodes_cache = None  # Tuple[int, Tuple[node.Node]]
+    self._tensors_cache = None  # Tuple[int, List[tensor.Tensor]]
 
   @property
   def name(self):
@@ -92,8 +102,9 @@ class BaseGraph(object):
     if not isinstance(name, string_types):
       raise TypeError("name must be a string; got type {}".format(type(name)))
 
-    if self.contains_node(name):
-      return self._node_name_to_node[name]
+    ret = self._node_name_to_node.get(name)
+    if ret is not None:
+      return ret
     elif self.contains_tensor(name):
       return self.get_tensor_by_name(name)
     else:
@@ -123,7 +134,7 @@ class BaseGraph(object):
     if not isinstance(name, string_types):
       raise ValueError("Node name argument is not a string, but is of type "
                        "{}".format(type(name)))
-    return name in self._node_name_to_node.keys()
+    return name in self._node_name_to_node
 
   def add_node(self,
                name, # type: str
@@ -161,11 +172,14 @@ class BaseGraph(object):
                     op_name=op_name,
                     debug_info=debug_info)
     self._node_name_to_node[name] = ret
+    self._node_names_lowercase.add(name.lower())
     self.increment_version_counter()
+    self.invalidate_frame_info()
     return ret
 
   def add_node_from_node_def(self,
                              node_def, # type: tf.NodeDef
+                             *,
                              set_inputs = False, # type: bool
                              set_control_inputs = False # type: bool
                              ):
@@ -230,7 +244,9 @@ class BaseGraph(object):
     # noinspection PyProtectedMember
     n._remove_from_graph()
     del self._node_name_to_node[name]
+    self._node_names_lowercase.discard(name.lower())
     self.increment_version_counter()
+    self.invalidate_frame_info()
     # Don't need to update collection info because collection membership is
     # stored in the node.
     # Don't need to update consumers of tensors because that information is
@@ -253,6 +269,8 @@ class BaseGraph(object):
     n._change_name(new_name)
     del self._node_name_to_node[old_name]
     self._node_name_to_node[new_name] = n
+    self._node_names_lowercase.discard(old_name.lower())
+    self._node_names_lowercase.add(new_name.lower())
     self.increment_version_counter()
 
   def add_variable(self, name):
@@ -321,7 +339,7 @@ class BaseGraph(object):
 
     Returns True if the indicated name is currently in use, ignoring case.
     """
-    return name.lower() in [k.lower() for k in self._node_name_to_node.keys()]
+    return name.lower() in self._node_names_lowercase
 
   def unique_name(self, name):
     # type: (str) -> str
@@ -347,14 +365,19 @@ class BaseGraph(object):
       return name
 
     # Generate a unique version by appending "_1", "_2", etc. until we find
-    # an unused name. Note that this approach will behave slightly
-    # differently from the original if nodes are deleted.
-    i = 1
-    new_name = "{}_{}".format(name, i)
-    while self._name_in_use(new_name):
-      i = i + 1
-      new_name = "{}_{}".format(name, i)
-    return new_name
+    # an unused name, resuming from the cached counter for this name so the
+    # probing is amortized O(1) across bulk insertions. Note that this
+    # approach will behave slightly differently from the original if nodes
+    # are deleted.
+    # The probe loop works directly on the lowercase name set so that each
+    # iteration is one f-string build plus one set probe.
+    name_lower = name.lower()
+    names_in_use = self._node_names_lowercase
+    i = self._unique_name_counters.get(name, 0) + 1
+    while f"{name_lower}_{i}" in names_in_use:
+      i += 1
+    self._unique_name_counters[name] = i
+    return f"{name}_{i}"
 
   @property
   def node_names(self):
@@ -367,9 +390,14 @@ class BaseGraph(object):
     """
     Returns:
       A list of all nodes, both immutable and mutable, present in the graph
-      after the edits that this object is buffering.
+      after the edits that this object is buffering. The returned tuple is
+      cached and shared between calls until the graph is next modified.
     """
-    return tuple(self._node_name_to_node.values())
+    cache = self._nodes_cache
+    if cache is None or cache[0] != self._version:
+      cache = (self._version, tuple(self._node_name_to_node.values()))
+      self._nodes_cache = cache
+    return cache[1]
 
   @property
   def tensors(self):
@@ -378,10 +406,14 @@ class BaseGraph(object):
     Return a list of all the tensors which are input or output of an op in
     the graph.
     """
-    ts = []
-    for op in self.nodes:
-      ts += op.outputs
-    return ts
+    cache = self._tensors_cache
+    if cache is None or cache[0] != self._version:
+      cache = (self._version,
+               [t for op in self._node_name_to_node.values()
+                for t in op.outputs])
+      self._tensors_cache = cache
+    # Hand out a copy; callers are allowed to mutate the returned list.
+    return list(cache[1])
 
   def contains_tensor(self, tensor_name):
     # type: (str) -> bool
@@ -469,6 +501,17 @@ class BaseGraph(object):
       raise RuntimeError("Detected a change to a frozen graph")
     self._version += 1
 
+  def invalidate_frame_info(self):
+    """
+    Throw away any cached information about the control flow frames of the
+    graph's nodes. To be called by mutations that can change frame structure:
+    adding or removing nodes, rewiring edges, or editing Enter/Exit nodes.
+
+    This base class keeps no frame information, so this implementation is a
+    no-op; subclasses that cache frame tables override it.
+    """
+    pass
+
   def visualize(
       self,
       format=None,
@@ -219,11 +219,18 @@ class FunctionGraph(base_graph.BaseGraph):
     information about the edges of the graph.
     """
     super(FunctionGraph, self).increment_version_counter()
-    self._node_to_frame_names = None
-    self._frame_name_to_nodes = None
     self._head_name_to_coloc_group = None
     self._collection_name_to_type = None
 
+  def invalidate_frame_info(self):
+    """
+    Throw away the cached control flow frame tables. Called only by mutations
+    that can actually change frame structure; attribute or device edits leave
+    the tables intact.
+    """
+    self._node_to_frame_names = None
+    self._frame_name_to_nodes = None
+
   def frame_name_to_nodes(self, frame_name):
     # type: (str) -> Tuple[node.Node]
     """
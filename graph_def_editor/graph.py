@@ -19,15 +19,16 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import os
+
 from six import string_types
 import tensorflow.compat.v1 as tf
 import sys
 if sys.version >= '3':
   from typing import Tuple, Dict, FrozenSet, Iterable, Union, Set, Any
-import queue
 
 from graph_def_editor import base_graph, function_graph, node, util, tensor, variable, subgraph
 import graph_def_editor.visualization.graphviz_wrapper as gvw
@@ -35,6 +36,19 @@ import graph_def_editor.visualization.graphviz_wrapper as gvw
 # TODO: Move this protobuf into this project so we don't depend on
 #  tf.core.framework
 from tensorflow.core.protobuf import saved_model_pb2, meta_graph_pb2
+from tensorflow.python.framework import op_def_registry
+
+try:
+  from google.protobuf.internal import api_implementation
+  # Both "cpp" (legacy protobuf 3.x) and "upb" (protobuf 4+) are fast
+  # C-based backends; only the pure-Python fallback is worth flagging.
+  if api_implementation.Type() == "python":
+    tf.logging.warning(
+      "google.protobuf is using the pure-Python backend. "
+      "Parsing large graphs will be slow.")
+except ImportError:
+  # Internal protobuf module; don't fail if it moves in a future release.
+  pass
 
 
 __all__ = [
@@ -50,6 +64,13 @@ __all__ = [
 _FRAME_NAME_ATTR = "frame_name"
 _INPUT_DUMMY_OP_NAME = "__input__"
 
+# Magical attribute in which TensorFlow stores output shape information.
+_OUTPUT_SHAPES_ATTR_NAME = "_output_shapes"
+
+# Minimum number of operations before _decode_graph() spreads dtype/shape
+# extraction across worker threads; below this the pool overhead dominates.
+_PARALLEL_DECODE_MIN_OPS = 2048
+
 
 class GraphVisitor(object):
   """
@@ -129,6 +150,7 @@ class Graph(base_graph.BaseGraph):
       object_graph_def=None,  # type: saved_object_graph_pb2.SavedObjectGraph
       stripped_op_list=None,  # type: op_def_pb2.OpList
       asset_file_def=None,  # type: meta_graph_pb2.AssetFileDef
+      full_shape_inference=True,  # type: bool
   ):
     """Wrap a tf.GraphDef protocol buffer in a Graph object.
 
@@ -150,6 +172,13 @@ class Graph(base_graph.BaseGraph):
       object_graph_def: Optional SavedObjectGraph for TF2.x.
       stripped_op_list: Optional stripped op list.
       asset_file_def: Optional saved model assets.
+      full_shape_inference: If True (the default), run the graph through
+        `tf.import_graph_def` to recover exact output shapes. If False,
+        decode output dtypes directly from the NodeDefs and the OpDef
+        registry, which is dramatically faster on large graphs; output
+        shapes are then unknown unless a node carries an explicit
+        "_output_shapes" attribute. Rewrites that never consult shapes can
+        safely pass False.
     """
     if name is None:
       time_str = datetime.datetime.now().isoformat()
@@ -175,7 +204,9 @@ class Graph(base_graph.BaseGraph):
       raise ValueError("signature_info argument must be a SignatureInfo object")
 
     # Caching tf.Graph object, so we won't have to load it again.
-    if self._graph is None:
+    # When shape inference is disabled, the tf.Graph is only materialized on
+    # demand (see _get_tf_graph()).
+    if self._graph is None and full_shape_inference:
       self._graph = tf.Graph()
       with self._graph.as_default():
         tf.import_graph_def(self._graph_def, name="")
@@ -185,7 +216,11 @@ class Graph(base_graph.BaseGraph):
     self._frozen = False  # bool
     self._next_id = 1  # int
     self._node_name_to_node = {}  # Dict[str, node.Node]; key is node name
-    output_map = _decode_graph(self._graph)
+    self._node_names_lowercase = set()  # Set[str]; see BaseGraph._name_in_use
+    if full_shape_inference:
+      output_map = _decode_graph(self._graph)
+    else:
+      output_map = _decode_graph_def(self._graph_def)
     self._node_to_frame_names = None
     self._frame_name_to_nodes = None
     self._head_name_to_coloc_group = None  # Dict[str, FrozenList[str]]
@@ -195,15 +230,25 @@ class Graph(base_graph.BaseGraph):
     self._passthrough_saver = None
     self._passthrough_versions = self._graph_def.versions  # tf.VERSIONDef
     self._function_graphs = dict()  # Dict[str, gde.FuncGraph], on demand
-
-    # Load nodes in three passes because the g may contain cycles.
-    for node_def in self._graph_def.node:
-      self.add_node_from_node_def(node_def, set_inputs=False)
-    for node_def in self._graph_def.node:
-      self[node_def.name].set_outputs_from_pairs(output_map[node_def.name])
-    for node_def in self._graph_def.node:
-      self[node_def.name].set_inputs_from_strings(node_def.input,
-                                                  set_control_inputs=True)
+    # Memoized result of to_graph_def(), invalidated whenever _version moves.
+    self._graph_def_cache = None  # Tuple[int, bool, tf.GraphDef]
+
+    # Load nodes in two passes because the g may contain cycles: create
+    # every node (with its outputs) first, then resolve input strings once
+    # all producers exist. Keeping the Node objects from the first pass
+    # avoids a by-name lookup per node and pass over the proto.
+    # The scratch list is allocated at full size up front; the node table
+    # itself can't be pre-sized without reordering its keys (dict.fromkeys
+    # only pre-allocates for set/dict arguments, and a set would scramble
+    # the node order that to_graph_def() has to preserve).
+    node_defs = self._graph_def.node
+    nodes_and_inputs = [None] * len(node_defs)
+    for i, node_def in enumerate(node_defs):
+      n = self.add_node_from_node_def(node_def, set_inputs=False)
+      n.set_outputs_from_pairs(output_map[node_def.name])
+      nodes_and_inputs[i] = (n, node_def.input)
+    for n, input_strings in nodes_and_inputs:
+      n.set_inputs_from_strings(input_strings, set_control_inputs=True)
     # Collections reference nodes and variables
     if collections is not None:
       for k, c in collections.items():
@@ -217,6 +262,36 @@ class Graph(base_graph.BaseGraph):
     self._stripped_op_list = stripped_op_list
     self._asset_file_def = asset_file_def
 
+  @classmethod
+  def from_graph_def_fast(cls, graph_def, name=None):
+    # type: (tf.GraphDef, str) -> Graph
+    """
+    Construct a `Graph` without running TensorFlow's full shape inference.
+
+    Shorthand for `Graph(graph_def, full_shape_inference=False)`. Output
+    dtypes are decoded from the OpDef registry and shapes come from any
+    `_output_shapes` attributes already present in the proto, so loading
+    runs at NodeDef ingestion speed instead of paying for
+    `tf.import_graph_def`. Suitable for rewrites that only consult dtypes
+    and edge structure; shape-dependent callers should use the regular
+    constructor.
+
+    Args:
+      graph_def: `tf.GraphDef` protobuf that represents a TensorFlow graph
+      name: Optional human-readable name for the graph. If not provided,
+        the constructor will generate a name.
+
+    Returns:
+      A fresh `Graph` object wrapping `graph_def`.
+
+    Raises:
+      ValueError if the proto contains a node whose op type is not in the
+      OpDef registry; in particular, nodes that invoke library functions
+      defined in the proto are not registered, so graphs containing such
+      calls must use the regular constructor.
+    """
+    return cls(g=graph_def, name=name, full_shape_inference=False)
+
   @property
   def has_passthrough_saver(self):
     return self._passthrough_saver is not None
@@ -293,11 +368,24 @@ class Graph(base_graph.BaseGraph):
     if function_name not in self._function_graphs:
       self._function_graphs[function_name] = function_graph.FunctionGraph(
           name=function_name,
-          parent_tf_graph=self._graph,
+          parent_tf_graph=self._get_tf_graph(),
           parent_graph=self)
 
     return self._function_graphs[function_name]
 
+  def _get_tf_graph(self):
+    # type: () -> tf.Graph
+    """
+    Returns the cached `tf.Graph` representation of this graph, importing
+    the GraphDef on first use if the constructor skipped that step (see the
+    `full_shape_inference` constructor argument).
+    """
+    if self._graph is None:
+      self._graph = tf.Graph()
+      with self._graph.as_default():
+        tf.import_graph_def(self._graph_def, name="")
+    return self._graph
+
   def to_graph_def(self, add_shapes=True):
     # type: (bool) -> tf.compat.v1.GraphDef
     """
@@ -306,8 +394,13 @@ class Graph(base_graph.BaseGraph):
         output shape information from this Node's output metadata.
 
     Returns the `tf.GraphDef` serialization of this graph in its current
-    form.
+    form. Repeated calls on an unmodified graph return a cached proto;
+    callers must not mutate the returned message.
     """
+    if (self._graph_def_cache is not None
+        and self._graph_def_cache[0] == self._version
+        and self._graph_def_cache[1] == add_shapes):
+      return self._graph_def_cache[2]
     ret = tf.GraphDef()
     ret.versions.CopyFrom(self._passthrough_versions)
     for op in self.nodes:
@@ -329,6 +422,7 @@ class Graph(base_graph.BaseGraph):
       ret.library.function[function_index_to_update].Clear()
       ret.library.function[function_index_to_update].MergeFrom(
           f_graph.to_function_graph_def())
+    self._graph_def_cache = (self._version, add_shapes, ret)
     return ret
 
   def to_tf_graph(self):
@@ -512,11 +606,18 @@ class Graph(base_graph.BaseGraph):
     information about the edges of the graph.
     """
     super(Graph, self).increment_version_counter()
-    self._node_to_frame_names = None
-    self._frame_name_to_nodes = None
     self._head_name_to_coloc_group = None
     self._collection_name_to_type = None
 
+  def invalidate_frame_info(self):
+    """
+    Throw away the cached control flow frame tables. Called only by mutations
+    that can actually change frame structure; attribute or device edits leave
+    the tables intact.
+    """
+    self._node_to_frame_names = None
+    self._frame_name_to_nodes = None
+
   def get_collection_by_name(self, name):
     # type: (str) -> Iterable[Any]
     """Fetch the contents of a collection, similarly to the method in
@@ -752,16 +853,18 @@ class Graph(base_graph.BaseGraph):
     if visited_nodes is None:
       visited_nodes = set()
 
-    nodes_queue = queue.Queue()
+    # Plain deque rather than queue.Queue; we don't need the latter's
+    # thread-safety locking on this single-threaded traversal.
+    nodes_queue = deque()
     function_graph_names_set = set()
 
     starting_nodes_set = set()
     for n in starting_nodes:
-      nodes_queue.put((n, None, max_depth))
+      nodes_queue.append((n, None, max_depth))
       starting_nodes_set.add(n)
 
-    while not nodes_queue.empty():
-      (n, input_tensor, depth) = nodes_queue.get()
+    while nodes_queue:
+      (n, input_tensor, depth) = nodes_queue.popleft()
       if n in visited_nodes:
         continue
       if n.op_type != _INPUT_DUMMY_OP_NAME:
@@ -800,9 +903,9 @@ class Graph(base_graph.BaseGraph):
               consumer not in starting_nodes_set:
             if depth is not None and depth <= 0:
               return True
-            nodes_queue.put((consumer,
-                             output_tensor,
-                             depth-1 if depth is not None else None))
+            nodes_queue.append((consumer,
+                                output_tensor,
+                                depth-1 if depth is not None else None))
 
     if escape_functions and function_graph_names_set:
       function_invocation_ops = self.nodes_iterator(
@@ -857,7 +960,7 @@ class Graph(base_graph.BaseGraph):
     if not starting_nodes:
       raise ValueError("starting_nodes is not provided")
 
-    nodes_queue = queue.Queue()
+    nodes_queue = deque()
     function_graph_names_set = set()
 
     if visited_nodes is None:
@@ -866,10 +969,10 @@ class Graph(base_graph.BaseGraph):
     starting_nodes_set = set()
     for n in starting_nodes:
       starting_nodes_set.add(n)
-      nodes_queue.put((n, max_depth))
+      nodes_queue.append((n, max_depth))
 
-    while not nodes_queue.empty():
-      (n, depth) = nodes_queue.get()
+    while nodes_queue:
+      (n, depth) = nodes_queue.popleft()
 
       if n in visited_nodes:
         continue
@@ -901,7 +1004,8 @@ class Graph(base_graph.BaseGraph):
             input_tensor.op not in starting_nodes_set):
           if depth is not None and depth <= 0:
             return True
-          nodes_queue.put((input_tensor.op, depth-1 if depth is not None else None))
+          nodes_queue.append((input_tensor.op,
+                              depth-1 if depth is not None else None))
 
     if escape_functions and function_graph_names_set:
       function_invocation_ops = self.nodes_iterator(
@@ -959,9 +1063,26 @@ class Graph(base_graph.BaseGraph):
         # We use None to represent the root frame.
         self.frame_name_stack = [None]
         self.frame_name_tuple = tuple()  # Immutable version for table
+        # Intern one tuple per unique stack state; most nodes share a frame
+        # stack with many other nodes, so sharing a single tuple object per
+        # state avoids building a throwaway tuple at every Enter/Exit.
+        self.stack_tuple_cache = {}
 
         self.new_node_to_frame_names = {}
         self.new_frame_name_to_nodes = {}
+        # Per-frame node lists for the frames currently on the stack. Only
+        # recomputed when the stack changes, so the per-node bookkeeping
+        # below is a plain append per active frame with no dict probes.
+        self.active_frame_lists = [self.new_frame_name_to_nodes
+                                   .setdefault(None, [])]
+
+      def _on_stack_change(self):
+        new_tuple = tuple(self.frame_name_stack)
+        self.frame_name_tuple = self.stack_tuple_cache.setdefault(new_tuple,
+                                                                  new_tuple)
+        self.active_frame_lists = [
+          self.new_frame_name_to_nodes.setdefault(f, [])
+          for f in self.frame_name_stack]
 
       def visit_node(self,
                      cur_node # type: node.Node
@@ -975,14 +1096,14 @@ class Graph(base_graph.BaseGraph):
                                                  cur_node.op_type,
                                                  _FRAME_NAME_ATTR))
           self.frame_name_stack.append(cur_node.get_attr(_FRAME_NAME_ATTR))
-          self.frame_name_tuple = tuple(self.frame_name_stack)
+          self._on_stack_change()
         elif cur_node.op_type in ["Exit", "RefExit"]:
           self.frame_name_stack.pop(-1)
-          self.frame_name_tuple = tuple(self.frame_name_stack)
+          self._on_stack_change()
         # Update tables
         self.new_node_to_frame_names[cur_node] = self.frame_name_tuple
-        for f in self.frame_name_stack:
-          self.new_frame_name_to_nodes.setdefault(f, []).append(cur_node)
+        for frame_nodes in self.active_frame_lists:
+          frame_nodes.append(cur_node)
 
     visitor = _MyVisitor()
     self.breadth_first_visitor(visitor)
@@ -1233,8 +1354,104 @@ def _decode_graph(graph):
   # graph_def describes. This approach makes things easier, but there will be
   # a reduction in forwards compatibility, because import_graph_def() does a
   # lot of sanity checks that aren't necessary when rewriting a graph_def.
-  output_map = {op.name: [(t.dtype, t.shape) for t in op.outputs]
-                for op in graph.get_operations()}
+  #
+  # Each op's outputs list is materialized exactly once here, and tf.Tensor
+  # caches dtype and shape after the first access, so this pass costs one
+  # Python<->C crossing per output. Callers that want to skip the
+  # import_graph_def() call entirely can construct the Graph with
+  # full_shape_inference=False, which decodes output types from the OpDef
+  # registry instead.
+  ops = graph.get_operations()
+
+  def _extract(ops_chunk):
+    return {op.name: [(t.dtype, t.shape) for t in op.outputs]
+            for op in ops_chunk}
+
+  if len(ops) < _PARALLEL_DECODE_MIN_OPS:
+    return _extract(ops)
+
+  # The dtype/shape accessors release the GIL inside TensorFlow's C API, so
+  # for large graphs the extraction parallelizes across worker threads.
+  num_workers = min(os.cpu_count() or 1, 8)
+  chunk_size = -(-len(ops) // num_workers)  # Ceiling division
+  output_map = {}
+  with ThreadPoolExecutor(max_workers=num_workers) as pool:
+    for partial_map in pool.map(_extract,
+                                [ops[i:i + chunk_size]
+                                 for i in range(0, len(ops), chunk_size)]):
+      output_map.update(partial_map)
+  return output_map
+
+
+def _node_def_output_dtypes(node_def, op_def):
+  # type: (tf.NodeDef, Any) -> List[tf.DType]
+  """
+  Resolve the output dtypes of a node from its attributes and the OpDef of
+  its op type, following the same rules that TensorFlow's C++ core applies
+  (type, type_attr, type_list_attr and number_attr fields of the output
+  arguments).
+  """
+  dtypes = []
+  attr = node_def.attr
+  for output_arg in op_def.output_arg:
+    if output_arg.number_attr:
+      count = attr[output_arg.number_attr].i
+      if output_arg.type_attr:
+        dtype = tf.as_dtype(attr[output_arg.type_attr].type)
+      else:
+        dtype = tf.as_dtype(output_arg.type)
+      arg_dtypes = [dtype] * count
+    elif output_arg.type_list_attr:
+      arg_dtypes = [tf.as_dtype(t)
+                    for t in attr[output_arg.type_list_attr].list.type]
+    elif output_arg.type_attr:
+      arg_dtypes = [tf.as_dtype(attr[output_arg.type_attr].type)]
+    else:
+      arg_dtypes = [tf.as_dtype(output_arg.type)]
+    if output_arg.is_ref:
+      # Every output of this arg is a ref, including all elements of
+      # number_attr/type_list_attr expansions.
+      # pylint: disable=protected-access
+      arg_dtypes = [d._as_ref for d in arg_dtypes]
+    dtypes.extend(arg_dtypes)
+  return dtypes
+
+
+def _decode_graph_def(graph_def):
+  # type: (tf.GraphDef) -> Dict[str, List[Tuple[tf.DType, tf.TensorShape]]]
+  """
+  Cheaper alternative to `_decode_graph()` that computes output dtypes
+  straight from the NodeDef protos and the OpDef registry, without paying
+  for `tf.import_graph_def`'s validation and shape inference.
+
+  Output shapes are unknown unless a node carries an explicit
+  "_output_shapes" attribute.
+
+  Args:
+    graph_def: tf.GraphDef protobuf that represents a TensorFlow graph.
+
+  Returns:
+    A map from node name to a list of (type, shape) pairs that describe
+    in turn each of the outputs of said node.
+  """
+  unknown_shape = tf.TensorShape(None)
+  output_map = {}
+  for node_def in graph_def.node:
+    op_def = op_def_registry.get(node_def.op)
+    if op_def is None:
+      raise ValueError("Op type '{}' of node '{}' is not registered with "
+                       "the current version of TensorFlow".format(
+                           node_def.op, node_def.name))
+    dtypes = _node_def_output_dtypes(node_def, op_def)
+    if _OUTPUT_SHAPES_ATTR_NAME in node_def.attr:
+      shape_protos = node_def.attr[_OUTPUT_SHAPES_ATTR_NAME].list.shape
+      if len(shape_protos) == len(dtypes):
+        shapes = [tf.TensorShape(p) for p in shape_protos]
+      else:
+        shapes = [unknown_shape] * len(dtypes)
+    else:
+      shapes = [unknown_shape] * len(dtypes)
+    output_map[node_def.name] = list(zip(dtypes, shapes))
   return output_map
 
 
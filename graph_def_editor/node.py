@@ -38,6 +38,12 @@ _COLOCATION_PREFIX = "loc:@"
 # skip shape inference if it is present.
 _OUTPUT_SHAPES_ATTR_NAME = "_output_shapes"
 
+# Attribute in which Enter nodes store the name of their control flow frame.
+_FRAME_NAME_ATTR = "frame_name"
+
+# Op types that open or close a control flow frame.
+_FRAME_OP_TYPES = frozenset(["Enter", "RefEnter", "Exit", "RefExit"])
+
 __all__ = [
     "Node",
 ]
@@ -104,6 +110,12 @@ class Node(object):
     self._colocation_groups = []  # List[str]
     self._collection_names = set()  # Set[str]
     self._debug_info = debug_info
+    # Cached serialization of this node, tagged with the graph version and
+    # add_shapes flag it was built under. The graph version covers changes to
+    # *other* nodes (such as renames of input nodes) that alter the strings in
+    # this node's serialized form; mutations of this node itself clear the
+    # cache directly via _invalidate_node_def_cache().
+    self._node_def_cache = None  # Tuple[int, bool, tf.NodeDef]
 
   def __repr__(self):
     # type: () -> str
@@ -132,6 +144,8 @@ class Node(object):
       new_name: New value for the `name` attribute.
     """
     self._name = new_name
+    # Parent graph bumps the version counter; just drop the stale serialization
+    self._node_def_cache = None
 
   @property
   def op_type(self):
@@ -152,7 +166,10 @@ class Node(object):
         to the name of a TensorFlow op, although this method does not validate
         the string.
     """
+    if (new_op_type in _FRAME_OP_TYPES or self._op_name in _FRAME_OP_TYPES):
+      self._invalidate_frame_info()
     self._op_name = new_op_type
+    self._invalidate_node_def_cache()
 
   @property
   def graph(self):
@@ -184,6 +201,26 @@ class Node(object):
     # Don't need to update output tensors because they don't store a pointer
     # to the graph, only to the node
 
+  def _invalidate_node_def_cache(self):
+    # type: () -> None
+    """
+    Discard any cached serialization of this node and bump the parent graph's
+    version counter, since serialized copies of the graph depend on this
+    node's contents. To be called by every method that mutates the node.
+    """
+    self._node_def_cache = None
+    if self._graph is not None:
+      self._graph.increment_version_counter()
+
+  def _invalidate_frame_info(self):
+    # type: () -> None
+    """
+    Tell the parent graph to discard cached control flow frame information.
+    To be called by mutations that can change frame structure.
+    """
+    if self._graph is not None:
+      self._graph.invalidate_frame_info()
+
   @property
   def outputs(self):
     # type: () -> Tuple[tensor.Tensor]
@@ -242,7 +279,8 @@ class Node(object):
       raise IndexError("Received input index {}, but node has {} "
                        "inputs".format(index, len(self._inputs)))
     self._inputs[index] = new_input
-    self._graph.increment_version_counter()
+    self._invalidate_node_def_cache()
+    self._invalidate_frame_info()
 
   def set_inputs(self, new_inputs):
     # type: (Iterable[tensor.Tensor]) -> None
@@ -257,7 +295,8 @@ class Node(object):
         raise ValueError("Tensor {} points to graph {}, but this node is in a "
                          "different graph {}".format(t, t.graph, self.graph))
     self._inputs = list(new_inputs)
-    self._graph.increment_version_counter()  # New edges added to graph
+    self._invalidate_node_def_cache()  # New edges added to graph
+    self._invalidate_frame_info()
 
   @property
   def control_inputs(self):
@@ -283,6 +322,7 @@ class Node(object):
   def device(self, value):
     # type: (str) -> None
     self._device = value
+    self._invalidate_node_def_cache()
 
   @property
   def colocation_groups(self):
@@ -417,6 +457,7 @@ class Node(object):
       raise ValueError("Already have colocation group with '{}'".format(
         head_node_name))
     self._colocation_groups.append(head_node_name)
+    self._invalidate_node_def_cache()
 
   def to_node_def(self, target = None, add_shapes = True):
     # type: (tf.NodeDef, bool) -> tf.NodeDef
@@ -431,34 +472,43 @@ class Node(object):
         proto will *not* change if this node is changed after the call, and
         vice versa.
     """
+    graph_version = self._graph.version if self._graph is not None else -1
+    cache = self._node_def_cache
+    if (cache is None or cache[0] != graph_version or cache[1] != add_shapes):
+      node_def = tf.NodeDef()
+      node_def.name = self.name
+      node_def.op = self.op_type
+      for input_tensor in self.inputs:
+        node_def.input.append(input_tensor.name)
+      for control_input_node in self.control_inputs:
+        node_def.input.append("^" + control_input_node.name)
+      node_def.device = self.device
+      for (attr_name, attr_value) in self._attributes:
+        # Funky syntax for setting a field of a union in a protobuf
+        node_def.attr[attr_name].CopyFrom(
+          util.python_type_to_attr_value(attr_value, attr_name))
+      if len(self._colocation_groups) > 0:
+        # Serialize colocation groups. See docstring in getter for
+        # colocation_groups property for more information.
+        transformed_names = [_COLOCATION_PREFIX + name
+                             for name in self._colocation_groups]
+        node_def.attr[_COLOCATION_ATTR_NAME].CopyFrom(
+          util.python_type_to_attr_value(transformed_names,
+                                         _COLOCATION_ATTR_NAME)
+        )
+      if add_shapes and self._outputs is not None and len(self._outputs) > 0:
+        shapes_list = [t.shape for t in self._outputs]
+        node_def.attr[_OUTPUT_SHAPES_ATTR_NAME].CopyFrom(
+          util.python_type_to_attr_value(shapes_list, _OUTPUT_SHAPES_ATTR_NAME)
+        )
+      if self._debug_info is not None:
+        node_def.experimental_debug_info.CopyFrom(self._debug_info)
+      cache = (graph_version, add_shapes, node_def)
+      self._node_def_cache = cache
     if target is None:
       target = tf.NodeDef()
-    target.name = self.name
-    target.op = self.op_type
-    for input_tensor in self.inputs:
-      target.input.append(input_tensor.name)
-    for control_input_node in self.control_inputs:
-      target.input.append("^" + control_input_node.name)
-    target.device = self.device
-    for (attr_name, attr_value) in self._attributes:
-      # Funky syntax for setting a field of a union in a protobuf
-      target.attr[attr_name].CopyFrom(
-        util.python_type_to_attr_value(attr_value, attr_name))
-    if len(self._colocation_groups) > 0:
-      # Serialize colocation groups. See docstring in getter for
-      # colocation_groups property for more information.
-      transformed_names = [_COLOCATION_PREFIX + name
-                           for name in self._colocation_groups]
-      target.attr[_COLOCATION_ATTR_NAME].CopyFrom(
-        util.python_type_to_attr_value(transformed_names, _COLOCATION_ATTR_NAME)
-      )
-    if add_shapes and self._outputs is not None and len(self._outputs) > 0:
-      shapes_list = [t.shape for t in self._outputs]
-      target.attr[_OUTPUT_SHAPES_ATTR_NAME].CopyFrom(
-        util.python_type_to_attr_value(shapes_list, _OUTPUT_SHAPES_ATTR_NAME)
-      )
-    if self._debug_info is not None:
-      target.experimental_debug_info.CopyFrom(self._debug_info)
+    # Hand out a copy so that callers can't corrupt the cached proto.
+    target.CopyFrom(cache[2])
     return target
 
   def get_attr(self, key):
@@ -553,6 +603,9 @@ class Node(object):
     else:
       # Make sure attributes appear in protobuf in the order added
       self._attributes.append((key, value))
+      self._invalidate_node_def_cache()
+      if key == _FRAME_NAME_ATTR:
+        self._invalidate_frame_info()
 
   def _update_shapes(self, new_shapes):
     # type: (List[tf.TensorShape]) -> None
@@ -618,13 +671,20 @@ class Node(object):
         if self._attributes[i][0] == key:
           self._attributes[i] = (key, value)
           break
+      self._invalidate_node_def_cache()
+      if key == _FRAME_NAME_ATTR:
+        self._invalidate_frame_info()
 
   def clear_attrs(self):
     # type: () -> None
     """
     Remove any attributes that are attached to this node.
     """
+    had_frame_name = _FRAME_NAME_ATTR in self._attr_names()
     self._attributes = []
+    self._invalidate_node_def_cache()
+    if had_frame_name:
+      self._invalidate_frame_info()
 
   def _attr_names(self):
     # type: () -> List[str]
@@ -640,6 +700,8 @@ class Node(object):
       new_control_inputs: Iterable of `Node` objects in this node's parent graph
     """
     self._control_inputs = list(new_control_inputs)
+    self._invalidate_node_def_cache()
+    self._invalidate_frame_info()
 
   def set_outputs_from_pairs(self, new_outputs):
     # type: (List[Tuple[tf.DType, tf.TensorShape]) -> None
@@ -671,7 +733,7 @@ class Node(object):
     # in place.
     for i in range(len(new_outputs)):
       self._outputs[i].dtype, self._outputs[i].shape = new_outputs[i]
-    self._graph.increment_version_counter()  # Just in case
+    self._invalidate_node_def_cache()  # Just in case
 
   def infer_outputs(self):
     # type: () -> None
@@ -736,7 +798,8 @@ class Node(object):
     self._inputs = _decode_inputs(new_inputs, self._graph, output_map)
     if set_control_inputs:
       self._control_inputs = _decode_control_inputs(new_inputs, self._graph)
-    self._graph.increment_version_counter()  # New edges added to graph
+    self._invalidate_node_def_cache()  # New edges added to graph
+    self._invalidate_frame_info()
 
   @property
   def collection_names(self):
@@ -85,6 +85,8 @@ class Tensor(object):
             value # type: tf.DType
             ):
     self._dtype = value
+    # Output dtypes feed into the node's serialized form.
+    self._node._invalidate_node_def_cache()
 
   @property
   def shape(self):
@@ -96,6 +98,8 @@ class Tensor(object):
             value # type: tf.TensorShape
             ):
     self._shape = value
+    # Output shapes appear in the node's serialized "_output_shapes" attribute.
+    self._node._invalidate_node_def_cache()
 
   @property
   def graph(self):
@@ -21,11 +21,15 @@ from __future__ import division
 from __future__ import print_function
 
 from functools import partial
+from operator import attrgetter
 from six import iteritems
 from six import iterkeys
 from six import string_types
-from six import StringIO
 import tensorflow.compat.v1 as tf
+try:
+  from tensorflow.python.framework import op_def_registry as _op_def_registry
+except ImportError:
+  _op_def_registry = None
 import sys
 if sys.version >= '3':
   from typing import Iterable
@@ -105,17 +109,12 @@ def assign_renamed_collections_handler(info, elem, elem_):
     elem: the original element (`tf.Tensor` or `tf.Operation`)
     elem_: the transformed element
   """
-  known_collection_names = util.get_predefined_collection_names()
-  for name, collection in iteritems(info.collections):
+  if not info.has_collections:
+    return
+  for transformed_name, collection in info.renamed_collections:
     if elem not in collection:
       continue
 
-    if name in known_collection_names:
-      transformed_name = name
-    else:
-      transformed_name = info.new_name(name)
-
-    target_graph = info.graph_ # type: Graph
     if isinstance(elem_, (Node, Tensor, Variable)):
       elem_.add_to_collection(transformed_name)
     else:
@@ -141,7 +140,7 @@ def transform_op_if_inside_handler(info, op, keep_if_possible=True):
   Returns:
     The transformed op or None.
   """
-  if op in info.sgv.ops:
+  if op in info.ops:
     return info.transformed_ops[op]
   else:
     if keep_if_possible and info.graph is info.graph_:
@@ -181,18 +180,29 @@ def copy_op_handler(info,
   name_ = info.graph_.unique_name(name_)
   node_def_.name = name_
 
-  # Transform names in colocation groups.
+  # Transform names in colocation groups. Most nodes don't carry the
+  # attribute, so check once and skip the whole block when it's absent.
   if _COLOCATION_ATTR_NAME in node_def_.attr:
     cg_attr = node_def_.attr[_COLOCATION_ATTR_NAME]
     # Colocation group info is always a list of strings
     if cg_attr.list.s is None:
       raise ValueError("Invalid colocation group info '{}'".format(cg_attr))
     cg_attr_list = cg_attr.list.s
+    # The same group names tend to repeat across ops, so cache the rewritten
+    # bytes on the transform info instead of re-decoding every occurrence.
+    cg_cache = info.transformed_cg_names
+    as_str = tf.compat.as_str
+    as_bytes = tf.compat.as_bytes
+    prefix_len = len(_COLOCATION_PREFIX)
     for i in range(len(cg_attr_list)):
-      old_cg_str = tf.compat.as_str(cg_attr_list[i])
-      old_node_name = old_cg_str[len(_COLOCATION_PREFIX):]
-      new_node_name = info.new_name(old_node_name)
-      cg_attr_list[i] = tf.compat.as_bytes(_COLOCATION_PREFIX + new_node_name)
+      old_cg_bytes = cg_attr_list[i]
+      new_cg_bytes = cg_cache.get(old_cg_bytes)
+      if new_cg_bytes is None:
+        old_node_name = as_str(old_cg_bytes)[prefix_len:]
+        new_cg_bytes = as_bytes(
+            _COLOCATION_PREFIX + info.new_name(old_node_name))
+        cg_cache[old_cg_bytes] = new_cg_bytes
+      cg_attr_list[i] = new_cg_bytes
 
   # Mutate NodeDef if requested:
   if nodedef_fn is not None:
@@ -212,6 +222,39 @@ def copy_op_handler(info,
   return op_, op_.outputs
 
 
+def _op_is_stateless(op):
+  # type: (Node) -> bool
+  """Return True if `op` is registered as a stateless op type."""
+  if _op_def_registry is None:
+    return False
+  if hasattr(_op_def_registry, "get"):
+    op_def = _op_def_registry.get(op.op_type)
+  else:
+    op_def = _op_def_registry.get_registered_ops().get(op.op_type)
+  return op_def is not None and not op_def.is_stateful
+
+
+def _cse_signature(op, new_inputs):
+  """Compute a hashable signature of an op for deduplication purposes.
+
+  Two ops with equal signatures produce equivalent copies in the target
+  graph: same op type, same attributes, and same transformed inputs.
+
+  Args:
+    op: the `gde.Node` about to be copied.
+    new_inputs: the transformed inputs the copy would receive.
+  Returns:
+    A hashable signature, or None if the op must not be deduplicated
+    (stateful op type or op with control inputs).
+  """
+  if op.control_inputs or not _op_is_stateless(op):
+    return None
+  node_def = op.to_node_def(add_shapes=False)
+  node_def.name = ""
+  node_def.ClearField("input")
+  return (node_def.SerializeToString(deterministic=True), tuple(new_inputs))
+
+
 class TransformerInfo(object):
   """"Contains information about the result of a transform operation."""
 
@@ -228,6 +271,22 @@ class TransformerInfo(object):
     self._scope_ = info.scope_
     self._transformed_ops = info.transformed_ops
     self._transformed_ts = info.transformed_ts
+    # Prebuilt name-based and reverse indexes so that repeated calls to
+    # `transformed()`/`original()` are hash probes rather than linear scans
+    # over the transformed maps.
+    self._transformed_ops_by_name = {
+        op.name: op_ for op, op_ in iteritems(info.transformed_ops)}
+    self._transformed_ts_by_name = {
+        t.name: t_ for t, t_ in iteritems(info.transformed_ts)}
+    self._original_ops = {
+        op_: op for op, op_ in iteritems(info.transformed_ops)}
+    self._original_ts = {
+        t_: t for t, t_ in iteritems(info.transformed_ts)}
+    self._original_ops_by_name = {
+        op_.name: op for op, op_ in iteritems(info.transformed_ops)}
+    self._original_ts_by_name = {
+        t_.name: t for t, t_ in iteritems(info.transformed_ts)}
+    self._str_cache = None  # Rendered by __str__ on demand.
 
   def _get_transformed_map(self, top):
     """Return the correct container depending on the type of `top`."""
@@ -250,16 +309,17 @@ class TransformerInfo(object):
     Returns:
       the transformed tensor/operation (or None if no match is found).
     """
-    transformed_map = self._get_transformed_map(original_top)
     if isinstance(original_top, string_types):
-      for original, transformed in iteritems(transformed_map):
-        if original.name == original_top:
-          return transformed
-      return None if missing_fn is None else missing_fn(original_top)
-    else:
-      if original_top not in transformed_map:
+      transformed = self._transformed_ops_by_name.get(original_top)
+      if transformed is None:
+        transformed = self._transformed_ts_by_name.get(original_top)
+      if transformed is None:
         return None if missing_fn is None else missing_fn(original_top)
-      return transformed_map[original_top]
+      return transformed
+    transformed_map = self._get_transformed_map(original_top)
+    if original_top not in transformed_map:
+      return None if missing_fn is None else missing_fn(original_top)
+    return transformed_map[original_top]
 
   def _original_elem(self, transformed_top, missing_fn=None):
     """Return the original op/tensor corresponding to the transformed one.
@@ -271,13 +331,21 @@ class TransformerInfo(object):
     Returns:
       the original tensor/operation (or None if no match is found).
     """
-    transformed_map = self._get_transformed_map(transformed_top)
-    check_name = isinstance(transformed_top, string_types)
-    for original, transformed in iteritems(transformed_map):
-      if ((check_name and transformed.name == transformed_top) or
-              (not check_name and transformed == transformed_top)):
-        return original
-    return None if missing_fn is None else missing_fn(transformed_top)
+    if isinstance(transformed_top, string_types):
+      original = self._original_ops_by_name.get(transformed_top)
+      if original is None:
+        original = self._original_ts_by_name.get(transformed_top)
+    elif isinstance(transformed_top, Node):
+      original = self._original_ops.get(transformed_top)
+    elif isinstance(transformed_top, Tensor):
+      original = self._original_ts.get(transformed_top)
+    else:
+      raise TypeError(
+          "Expected a gde.Tensor or a gde.Node, got a {}".format(
+              type(transformed_top)))
+    if original is None:
+      return None if missing_fn is None else missing_fn(transformed_top)
+    return original
 
   def transformed(self, original, missing_fn=None):
     """Return the transformed op/tensor corresponding to the original one.
@@ -294,6 +362,15 @@ class TransformerInfo(object):
     Returns:
       the transformed tensor/operation (or None if no match is found).
     """
+    # Fast paths for the two overwhelmingly common call patterns -- a single
+    # element or a flat list of elements -- which skip the generic tree
+    # walker and its per-leaf partial() indirection.
+    if isinstance(original, (Node, Tensor)):
+      return self._transformed_elem(original, missing_fn)
+    if isinstance(original, list) and all(
+        isinstance(elem, (Node, Tensor)) for elem in original):
+      transformed_elem = self._transformed_elem
+      return [transformed_elem(elem, missing_fn) for elem in original]
     transformed_elem = partial(self._transformed_elem, missing_fn=missing_fn)
     return util.transform_tree(original, transformed_elem)
 
@@ -312,27 +389,39 @@ class TransformerInfo(object):
     Returns:
       the original tensor/operation (or None if no match is found).
     """
+    # Same fast paths as in transformed() above.
+    if isinstance(transformed, (Node, Tensor)):
+      return self._original_elem(transformed, missing_fn)
+    if isinstance(transformed, list) and all(
+        isinstance(elem, (Node, Tensor)) for elem in transformed):
+      original_elem = self._original_elem
+      return [original_elem(elem, missing_fn) for elem in transformed]
     original_elem = partial(self._original_elem, missing_fn=missing_fn)
     return util.transform_tree(transformed, original_elem)
 
   def __str__(self):
-    res = StringIO()
-    print("Transform result info:", file=res)
-    if self._graph == self._graph_:
-      in_place_str = "" if self._scope_ else " IN-PLACE"
-      print("  Within graph[{}]{}".format(
-          id(self._graph), in_place_str), file=res)
-    else:
-      print("  graph[{}] => graph[{}]".format(
-          id(self._graph), id(self._graph_)), file=res)
-    if self._scope:
-      print("  Relative to source scope: {}".format(self._scope), file=res)
-    if self._scope_:
-      print("  Scope destination: {}".format(self._scope_), file=res)
-    print("Operations mapping:", file=res)
-    for op, op_ in iteritems(self._transformed_ops):
-      print("  {} => {}".format(op.name, op_.name), file=res)
-    return res.getvalue()
+    # The mapping is immutable after construction, so the rendered string is
+    # computed once and cached. str.join is a single C-level concatenation,
+    # much cheaper than a Python-level write per mapping entry.
+    if self._str_cache is None:
+      lines = ["Transform result info:"]
+      if self._graph == self._graph_:
+        in_place_str = "" if self._scope_ else " IN-PLACE"
+        lines.append("  Within graph[{}]{}".format(
+            id(self._graph), in_place_str))
+      else:
+        lines.append("  graph[{}] => graph[{}]".format(
+            id(self._graph), id(self._graph_)))
+      if self._scope:
+        lines.append("  Relative to source scope: {}".format(self._scope))
+      if self._scope_:
+        lines.append("  Scope destination: {}".format(self._scope_))
+      lines.append("Operations mapping:")
+      lines.extend("  {} => {}".format(op.name, op_.name)
+                   for op, op_ in iteritems(self._transformed_ops))
+      lines.append("")  # Trailing newline, as the print-based version had.
+      self._str_cache = "\n".join(lines)
+    return self._str_cache
 
 
 class _TmpInfo(object):
@@ -350,6 +439,9 @@ class _TmpInfo(object):
                dst_scope,
                src_scope):
     self.sgv = sgv
+    # Evaluate the logging verbosity once; even a disabled tf.logging.debug
+    # call costs several Python frames per invocation in the copy loops.
+    self.debug = tf.logging.get_verbosity() <= tf.logging.DEBUG
     self.sgv_inputs_set = frozenset(sgv.inputs)
     self.ops = frozenset(sgv.ops)
     self.control_outputs = util.ControlOutputs(sgv.graph)
@@ -359,18 +451,55 @@ class _TmpInfo(object):
     self.scope_ = dst_scope
     self.transformed_ops = {}
     self.transformed_ts = {}
-    self.collections = dict((key, self.graph.get_collection_by_name(key))
-                            for key in self.graph.get_all_collection_keys())
+    # Memoized results of new_name(); scope and scope_ never change for the
+    # lifetime of this object, so renames are safe to cache.
+    self._new_name_cache = {}
+    # Collection contents are only materialized on first access (see the
+    # `collections` and `renamed_collections` properties); graphs without
+    # collections skip that work entirely.
+    self.has_collections = bool(self.graph.get_all_collection_keys())
+    self._collections = None
+    self._renamed_collections = None
     self.cyclic_ops = []
+    # Cache of old colocation-group bytes to transformed bytes; see
+    # copy_op_handler.
+    self.transformed_cg_names = {}
     self.transform_original_op_handler = transform_op_if_inside_handler
     # The graph is transformed op by op, in the same order the original ops
     # were created. However, this is sometimes not possible due to cycles
     # (i.e. while loops). So when the transformer creates a new op whose
     # inputs do not exist yet, temporary placeholders are created and stored
-    # in this `tmp_cyclic_ts` container. During a second pass,
-    # those temporary tensors are replaced by the proper transformed tensors
-    # (see the function `_finalize_cycles`).
+    # in this `tmp_cyclic_ts` container as `(tensor, consumer op, input index)`
+    # tuples. During a second pass, those temporary tensors are replaced by
+    # the proper transformed tensors (see the function `_finalize_cycles`).
     self.tmp_cyclic_ts = []
+    # One temporary placeholder per distinct cyclic tensor; a cyclic tensor
+    # feeding several consumers only mutates the destination graph once.
+    self.tmp_placeholders = {}
+
+  @property
+  def collections(self):
+    """Map from collection name to collection contents, built lazily."""
+    if self._collections is None:
+      self._collections = dict(
+          (key, self.graph.get_collection_by_name(key))
+          for key in self.graph.get_all_collection_keys())
+    return self._collections
+
+  @property
+  def renamed_collections(self):
+    """Transformed collection names paired with frozen collection contents.
+
+    Precomputed so that `assign_renamed_collections_handler`, which runs
+    once per transformed op and tensor, only performs membership tests.
+    """
+    if self._renamed_collections is None:
+      known_collection_names = util.get_predefined_collection_names()
+      self._renamed_collections = [
+          (name if name in known_collection_names else self.new_name(name),
+           frozenset(collection))
+          for name, collection in iteritems(self.collections)]
+    return self._renamed_collections
 
   def new_name(self, name):
     """Compute a destination name from a source name.
@@ -383,12 +512,16 @@ class _TmpInfo(object):
       ValueError: if the source scope is used (that is, not an empty string)
         and the source name does not belong to the source scope.
     """
+    cached = self._new_name_cache.get(name)
+    if cached is not None:
+      return cached
     scope = self.scope
     if not name.startswith(scope):
       raise ValueError("{} does not belong to source scope: {}.".format(
           name, scope))
     rel_name = name[len(scope):]
     name_ = self.scope_ + rel_name
+    self._new_name_cache[name] = name_
     return name_
 
 
@@ -420,6 +553,11 @@ class Transformer(object):
     transform_original_op_handler: handle the transform of original_op. This
       handler defaults to transforming original_op only if they are in the
       subgraph, otherwise they are ignored.
+    enable_cse: if True, source ops that are stateless, carry no control
+      inputs, and are identical up to their name (same op type, attributes
+      and transformed inputs) share a single copy in the target graph,
+      in the manner of common-subexpression elimination. Off by default so
+      that transforms preserve the source graph's structure exactly.
     """
 
     # handlers
@@ -429,6 +567,7 @@ class Transformer(object):
     self.transform_external_input_handler = replace_t_with_placeholder_handler
     self.transform_external_hidden_input_handler = keep_t_if_possible_handler
     self.transform_original_op_handler = transform_op_if_inside_handler
+    self.enable_cse = False
 
   def __call__(self,
                sgv,
@@ -483,25 +622,50 @@ class Transformer(object):
 
   def _copy_ops(self, info):
     """Copy ops without connecting them."""
-    sorted_ops = sorted(info.sgv.ops, key=lambda n: n.id_in_graph)
+    # SubGraphView usually hands back ops already in graph order; only sort
+    # when that isn't the case, and sort with a C-level key function.
+    sorted_ops = list(info.sgv.ops)
+    if any(a.id_in_graph > b.id_in_graph
+           for a, b in zip(sorted_ops, sorted_ops[1:])):
+      sorted_ops.sort(key=attrgetter("id_in_graph"))
+    # Bind frequently-used methods and containers to locals; attribute
+    # lookups are measurably slower than local variable access in this loop.
+    transformed_t = self._transformed_t
+    op_handler = self.transform_op_handler
+    collections_handler = self.assign_collections_handler
+    transformed_ops = info.transformed_ops
+    transformed_ts = info.transformed_ts
+    enable_cse = self.enable_cse
+    cse_map = {}
     for op in sorted_ops:
-      new_inputs = [self._transformed_t(info, t, op) for t in op.inputs]
-      op_, op_outputs_ = self.transform_op_handler(info, op, new_inputs)
-      if op is op_:
-        raise ValueError("In-place transformation not allowed.")
+      # op.inputs builds a fresh tuple on every access; fetch it once.
+      op_inputs = op.inputs
+      new_inputs = [transformed_t(info, t, op, i)
+                    for i, t in enumerate(op_inputs)]
+      sig = _cse_signature(op, new_inputs) if enable_cse else None
+      op_ = cse_map.get(sig) if sig is not None else None
+      if op_ is not None:
+        # An equivalent op was already copied; reuse it.
+        op_outputs_ = op_.outputs
+      else:
+        op_, op_outputs_ = op_handler(info, op, new_inputs)
+        if op is op_:
+          raise ValueError("In-place transformation not allowed.")
+        if sig is not None:
+          cse_map[sig] = op_
 
       # Process op.
-      info.transformed_ops[op] = op_
-      self.assign_collections_handler(info, op, op_)
+      transformed_ops[op] = op_
+      collections_handler(info, op, op_)
 
       # Process output tensors.
       for op_output, op_output_ in zip(op.outputs, op_outputs_):
-        info.transformed_ts[op_output] = op_output_
-        self.assign_collections_handler(info, op_output, op_output_)
+        transformed_ts[op_output] = op_output_
+        collections_handler(info, op_output, op_output_)
 
   def _finalize_cycles(self, info):
     """Reconnects the cyclic tensors."""
-    for t, tmp_t_, consumer_op in info.tmp_cyclic_ts:
+    for t, consumer_op, input_index in info.tmp_cyclic_ts:
       if t not in info.transformed_ts:
         raise ValueError("The tensor {} should be transformed by now.".format(
             t.name))
@@ -510,19 +674,29 @@ class Transformer(object):
             consumer_op.name))
       t_ = info.transformed_ts[t]
       consumer_op_ = info.transformed_ops[consumer_op]
-      t_index_ = list(consumer_op_.inputs).index(tmp_t_)
-      consumer_op_.replace_input(t_index_, t_)
+      consumer_op_.replace_input(input_index, t_)
 
   def _connect_control_inputs(self, info):
     """Connect the previously copied ops."""
+    control_input_handler = self.transform_control_input_handler
+    # The same source op commonly appears as a control input of many ops;
+    # transform each distinct control input once and reuse the result.
+    ctrl_cache = {}
     for op in info.sgv.ops:
-      tf.logging.debug("Connecting control inputs of op: %s", op.name)
+      if info.debug:
+        tf.logging.debug("Connecting control inputs of op: %s", op.name)
       op_ = info.transformed_ops[op]
 
       # Finalize control inputs:
-      control_inputs_ = [self.transform_control_input_handler(info, ci)
-                         for ci in op.control_inputs]
-      control_inputs_ = [ci for ci in control_inputs_ if ci is not None]
+      control_inputs_ = []
+      for ci in op.control_inputs:
+        if ci in ctrl_cache:
+          ci_ = ctrl_cache[ci]
+        else:
+          ci_ = control_input_handler(info, ci)
+          ctrl_cache[ci] = ci_
+        if ci_ is not None:
+          control_inputs_.append(ci_)
       op_.set_control_inputs(control_inputs_)
 
   def _transform_sgv(self, info, sgv):
@@ -537,40 +711,46 @@ class Transformer(object):
     Returns:
       The transformed subgraph.
     """
-    ops_ = [op_ for _, op_ in iteritems(info.transformed_ops)]
+    ops_ = list(info.transformed_ops.values())
     sgv_ = subgraph.SubGraphView(ops_)
     sgv_inputs_ = sgv_.inputs
     sgv_outputs_ = sgv_.outputs
+    # Index the boundary tensors once so the loops below do O(1) dict
+    # probes instead of a linear scan per input/output.
+    input_index_ = {t: i for i, t in enumerate(sgv_inputs_)}
+    output_index_ = {t: i for i, t in enumerate(sgv_outputs_)}
+
+    transformed_ts_get = info.transformed_ts.get
 
     # re-order inputs
     input_map_ = []
     for input_t in sgv.inputs:
-      if input_t not in info.transformed_ts:
+      input_t_ = transformed_ts_get(input_t)
+      if input_t_ is None:
         continue
-      input_t_ = info.transformed_ts[input_t]
-      if input_t_ not in sgv_inputs_:
-        continue
-      input_t_index_ = sgv_.input_index(input_t_)
-      input_map_.append(input_t_index_)
+      input_t_index_ = input_index_.get(input_t_)
+      if input_t_index_ is not None:
+        input_map_.append(input_t_index_)
 
     # re-order outputs
     output_map_ = []
     for output_t in sgv.outputs:
-      if output_t not in info.transformed_ts:
-        continue
-      output_t_ = info.transformed_ts[output_t]
-      if output_t_ not in sgv_outputs_:
+      output_t_ = transformed_ts_get(output_t)
+      if output_t_ is None:
         continue
-      output_t_index_ = sgv_.output_index(output_t_)
-      output_map_.append(output_t_index_)
+      output_t_index_ = output_index_.get(output_t_)
+      if output_t_index_ is not None:
+        output_map_.append(output_t_index_)
 
     return sgv_.remap(input_map_, output_map_)
 
-  def _transformed_t(self, info, t, consumer_op):
+  def _transformed_t(self, info, t, consumer_op, input_index):
     """Return tre transformed tensor of `t`."""
-    if t in info.transformed_ts:
-      # If op is in the subgraph, just return its transformed counterpart.
-      return info.transformed_ts[t]
+    # The common case by far is a tensor that has already been transformed;
+    # resolve it with a single dict probe.
+    t_ = info.transformed_ts.get(t)
+    if t_ is not None:
+      return t_
 
     if t in info.sgv_inputs_set:
       # `t` is an input of the subgraph.
@@ -578,22 +758,30 @@ class Transformer(object):
     elif t.node in info.ops:
       # `t` is an internal tensor but is not transformed yet because it
       # belongs to a graph cycle.
-      tf.logging.debug("Cyclic tensor: t.name = %s", t.name)
+      if info.debug:
+        tf.logging.debug("Cyclic tensor: t.name = %s", t.name)
       # Try to find an existing tensor we can use for now,
       # otherwise create one. We'll rewire this later.
       if consumer_op.op_type == "Merge":
         first_input = consumer_op.inputs[0]
-        tmp_t_ = self._transformed_t(info, first_input, consumer_op)
+        tmp_t_ = self._transformed_t(info, first_input, consumer_op,
+                                     input_index)
       elif t.node.op_type == "Enter":
         enter_input = t.node.inputs[0]
-        tmp_t_ = self._transformed_t(info, enter_input, consumer_op)
+        tmp_t_ = self._transformed_t(info, enter_input, consumer_op,
+                                     input_index)
       else:
-        tmp_t_ = util.make_placeholder_from_tensor(info.graph_, t,
-                                                   scope=info.scope_,
-                                                   prefix="geph_tmp")
-        tf.logging.debug("Created temporary placeholder: %s.", tmp_t_.name)
+        tmp_t_ = info.tmp_placeholders.get(t)
+        if tmp_t_ is None:
+          tmp_t_ = util.make_placeholder_from_tensor(info.graph_, t,
+                                                     scope=info.scope_,
+                                                     prefix="geph_tmp")
+          info.tmp_placeholders[t] = tmp_t_
+          if info.debug:
+            tf.logging.debug("Created temporary placeholder: %s.",
+                             tmp_t_.name)
       # Register as temporary and return.
-      info.tmp_cyclic_ts.append((t, tmp_t_, consumer_op))
+      info.tmp_cyclic_ts.append((t, consumer_op, input_index))
       return tmp_t_
     else:
       # `t` is a hidden input of the subgraph.
@@ -710,14 +898,37 @@ def _add_control_flow_ops(ops, control_ios):
   for frame_name in frame_names:
     new_ops.update(g.frame_name_to_nodes(frame_name))
   # Add in any nodes that the target nodes expect to be collocated with.
-  num_before = -1  # Always execute while loop below at least once.
-  # Colocation groups may overlap. Repeat until we reach a fixed point.
-  all_ops = new_ops.union(set(ops))
-  while num_before != len(all_ops):
-    num_before = len(all_ops)
-    for group in g.colocation_groups.values():
-      if len(all_ops.intersection(group)) > 0:
-        all_ops.update(group)
+  # Colocation groups may overlap, so the closure of the groups is computed
+  # with a union-find over group members rather than re-scanning every group
+  # until a fixed point is reached.
+  all_ops = new_ops.union(ops)
+  parent = {}
+
+  def _find(op):
+    """Find the union-find root of `op`, compressing the path."""
+    root = op
+    while parent[root] is not root:
+      root = parent[root]
+    while parent[op] is not root:
+      parent[op], op = root, parent[op]
+    return root
+
+  for group in g.colocation_groups.values():
+    root = None
+    for group_op in group:
+      parent.setdefault(group_op, group_op)
+      if root is None:
+        root = _find(group_op)
+      else:
+        group_op_root = _find(group_op)
+        if group_op_root is not root:
+          parent[group_op_root] = root
+  members = {}
+  for grouped_op in parent:
+    members.setdefault(_find(grouped_op), []).append(grouped_op)
+  for op in list(all_ops):
+    if op in parent:
+      all_ops.update(members[_find(op)])
   # Add any ops that weren't in the list before
   for op in all_ops.difference(ops):
     ops.append(op)
@@ -735,14 +946,20 @@ def _flatten_tree(tree, leaves=None):
   """
   if leaves is None:
     leaves = []
-  if isinstance(tree, dict):
-    for _, child in iteritems(tree):
-      _flatten_tree(child, leaves)
-  elif util.is_iterable(tree):
-    for child in tree:
-      _flatten_tree(child, leaves)
-  else:
-    leaves.append(tree)
+  # Walk the tree with an explicit stack rather than recursing; this avoids
+  # per-node frame allocation and the recursion limit on deeply nested trees.
+  # Children are pushed in reverse so leaves come out in the same order as
+  # the recursive version would produce.
+  is_iterable = util.is_iterable
+  stack = [tree]
+  while stack:
+    current = stack.pop()
+    if isinstance(current, dict):
+      stack.extend(reversed(list(current.values())))
+    elif is_iterable(current):
+      stack.extend(reversed(list(current)))
+    else:
+      leaves.append(current)
   return leaves
 
 
@@ -659,6 +659,49 @@ def python_type_to_attr_value(value, #type: Any
                          type(value), attr_name))
 
 
+# Decoder for each field of the AttrValue union that we know how to convert,
+# keyed by the field name that WhichOneof() reports. Lets
+# attr_value_to_python_type() dispatch with a single dict probe instead of
+# walking a chain of HasField() calls for every attribute decoded.
+_ATTR_VALUE_DECODERS = {
+  # TODO(frreiss): Should we return the binary value here?
+  "s": lambda attr_value: tf.compat.as_str(attr_value.s),        # str
+  "i": lambda attr_value: attr_value.i,                          # int
+  "f": lambda attr_value: attr_value.f,                          # float
+  "b": lambda attr_value: attr_value.b,                          # bool
+  "type": lambda attr_value: tf.DType(attr_value.type),          # DType
+  # Undocumented behavior of public API: tf.TensorShape constructor accepts
+  # a TensorShapeProto.
+  "shape": lambda attr_value: tf.TensorShape(attr_value.shape),  # TensorShape
+  "tensor": lambda attr_value: tf.make_ndarray(attr_value.tensor),
+  "list": lambda attr_value: attr_value.list,
+  "func": lambda attr_value: attr_value.func,
+}
+
+# Fields of the AttrValue union whose decoded form is immutable and can
+# therefore be shared between callers.
+_INTERNABLE_ATTR_FIELDS = frozenset(["s", "i", "f", "b", "type", "shape"])
+
+# Longest "s" attribute value (in bytes) that will be interned. Most string
+# attrs are short op parameters; the occasional large blob would otherwise
+# be pinned in memory for the life of the process.
+_MAX_INTERNED_S_BYTES = 256
+
+# Upper bound on interned entries across all graphs loaded in the process.
+# Once the cache is full, new values are decoded fresh rather than cached.
+_MAX_INTERNED_ATTR_VALUES = 65536
+
+# Interning cache for decoded attribute values, keyed by serialized
+# AttrValue. Large graphs repeat the same handful of dtype, shape and string
+# attribute values across most of their nodes, and attributes are decoded
+# anew on every Node.get_attr() call; sharing one decoded object per unique
+# value keeps the number of live objects at O(unique values). Mutable
+# decoded types (tensor, list, func) are never interned, and the limits
+# above keep the cache from growing without bound (most interned types
+# cannot be weakly referenced, so a weak-valued cache is not an option).
+_attr_value_intern = {}  # Dict[bytes, Any]
+
+
 def attr_value_to_python_type(
     attr_value,  # type: tf.AttrValue
     attr_name  # type: String
@@ -675,31 +718,23 @@ def attr_value_to_python_type(
     `attr_value` that is in use.
   """
   # TODO(frreiss): Handle AttrValues that are lists
-  if attr_value.HasField("s"):          # str
-    # TODO(frreiss): Should we return the binary value here?
-    return tf.compat.as_str(attr_value.s)
-  elif attr_value.HasField("i"):        # int
-    return attr_value.i
-  elif attr_value.HasField("f"):        # float
-    return attr_value.f
-  elif attr_value.HasField("b"):        # bool
-    return attr_value.b
-  elif attr_value.HasField("type"):     # DType
-    return tf.DType(attr_value.type)
-  elif attr_value.HasField("shape"):    # TensorShape
-    # Undocumented behavior of public API: tf.TensorShape constructor accepts
-    # a TensorShapeProto.
-    return tf.TensorShape(attr_value.shape)
-  elif attr_value.HasField("tensor"):   # TensorProto
-    return tf.make_ndarray(attr_value.tensor)
-  elif attr_value.HasField("list"):     # list
-    return attr_value.list
-  elif attr_value.HasField("func"):     # func
-    return attr_value.func
-  # TODO(frreiss): Convert the "placeholder" fields of the union  here
-  else:
+  # TODO(frreiss): Convert the "placeholder" fields of the union here
+  which_field = attr_value.WhichOneof("value")
+  decoder = _ATTR_VALUE_DECODERS.get(which_field)
+  if decoder is None:
     raise ValueError("Don't know how to convert AttrValue {} to "
                      "a Python object for attribute {}".format(attr_value, attr_name))
+  if which_field in _INTERNABLE_ATTR_FIELDS:
+    if which_field == "s" and len(attr_value.s) > _MAX_INTERNED_S_BYTES:
+      return decoder(attr_value)
+    intern_key = attr_value.SerializeToString()
+    ret = _attr_value_intern.get(intern_key)
+    if ret is None:
+      ret = decoder(attr_value)
+      if len(_attr_value_intern) < _MAX_INTERNED_ATTR_VALUES:
+        _attr_value_intern[intern_key] = ret
+    return ret
+  return decoder(attr_value)
 
 
 def load_variables_to_tf_graph(g # type: base_graph.BaseGraph
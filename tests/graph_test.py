@@ -632,5 +632,76 @@ class GraphTest(unittest.TestCase):
     }
     self.assertEqual(expected_gv_graph, gv_graph)
 
+  def test_to_graph_def_caching(self):
+    g = self.build_graph()
+    gd1 = g.to_graph_def()
+    # Repeated serialization of an unchanged graph returns the cached proto.
+    self.assertIs(g.to_graph_def(), gd1)
+
+    def node_def(graph_def, name):
+      return [n for n in graph_def.node if n.name == name][0]
+
+    # Attribute edits must invalidate the cache.
+    g["add"].add_attr("_foo", "foo")
+    gd2 = g.to_graph_def()
+    self.assertIsNot(gd2, gd1)
+    self.assertIn("_foo", node_def(gd2, "add").attr)
+
+    # Rewiring an input must show up in the next serialization.
+    g["add"].replace_input(1, g["c"].output(0))
+    gd3 = g.to_graph_def()
+    self.assertEqual(node_def(gd3, "add").input[1].split(":")[0], "c")
+
+    # Renaming a producer must refresh the serialized input strings of its
+    # consumers, whose own NodeDef caches were not directly touched.
+    g.rename_node("a", "a_renamed")
+    gd4 = g.to_graph_def()
+    self.assertEqual(node_def(gd4, "add").input[0].split(":")[0], "a_renamed")
+
+  def test_full_shape_inference_disabled(self):
+    tf_g = tf.Graph()
+    with tf_g.as_default():
+      a = tf.constant([1., 2.], name="a")
+      b = tf.constant([3., 4.], name="b")
+      _ = tf.add(a, b, name="add")
+    graph_def = tf_g.as_graph_def()
+
+    slow = gde.Graph(g=graph_def)
+    fast = gde.Graph(g=graph_def, full_shape_inference=False)
+
+    # Output dtypes must match what full shape inference produces.
+    for n in slow.nodes:
+      n_fast = fast[n.name]
+      self.assertEqual([t.dtype for t in n.outputs],
+                       [t.dtype for t in n_fast.outputs])
+
+    # as_graph_def() didn't attach _output_shapes attributes, so the fast
+    # path must fall back to unknown shapes.
+    self.assertIsNone(fast["add"].output(0).shape.ndims)
+
+    # With the attribute present, shapes come through.
+    fast_with_shapes = gde.Graph(g=tf_g.as_graph_def(add_shapes=True),
+                                 full_shape_inference=False)
+    self.assertEqual(fast_with_shapes["add"].output(0).shape.as_list(), [2])
+
+  def test_from_graph_def_fast(self):
+    tf_g = tf.Graph()
+    with tf_g.as_default():
+      a = tf.constant(1, name="a")
+      b = tf.constant(2, name="b")
+      _ = tf.add(a, b, name="add")
+    g = gde.Graph.from_graph_def_fast(tf_g.as_graph_def(add_shapes=True))
+    self.assertEqual(g["add"].output(0).dtype, tf.int32)
+    self.assertEqual(g["add"].output(0).shape.as_list(), [])
+
+    # Op types that aren't in the OpDef registry -- for example invocations
+    # of library functions -- must be refused instead of guessed at.
+    unregistered = tf.GraphDef()
+    node_def = unregistered.node.add()
+    node_def.name = "call"
+    node_def.op = "SomeUnregisteredFunction"
+    with self.assertRaises(ValueError):
+      gde.Graph.from_graph_def_fast(unregistered)
+
 if __name__ == "__main__":
   unittest.main()
@@ -172,6 +172,66 @@ class TransformTest(unittest.TestCase):
     for op in all_ops:
       self.assertEqual(op.get_attr("_bar"), "bar")
 
+  def test_transform_cse_off_preserves_structure(self):
+    transformer = gde.Transformer()
+    self.assertFalse(transformer.enable_cse)
+
+    graph = gde.Graph()
+    transformer(self.graph, graph, "", "")
+    # Const_1 and Const_2 are identical, but without CSE each source node
+    # must get its own copy.
+    self.assertEqual(
+        set(op.name for op in self.graph.nodes),
+        set(op.name for op in graph.nodes))
+
+  def test_transform_cse_merges_identical_stateless_ops(self):
+    transformer = gde.Transformer()
+    transformer.enable_cse = True
+
+    graph = gde.Graph()
+    _, info = transformer(self.graph, graph, "", "")
+
+    # Const_1, Const_2 and Input are identical stateless constants once
+    # their names are stripped; Const differs (it carries the extra "_foo"
+    # attribute) and must stay separate.
+    merged = info.transformed(self.graph["Const_1"])
+    self.assertIs(info.transformed(self.graph["Const_2"]), merged)
+    self.assertIs(info.transformed(self.graph["Input"]), merged)
+    self.assertIsNot(info.transformed(self.graph["Const"]), merged)
+    self.assertFalse(graph.contains_node("Const_2"))
+    self.assertFalse(graph.contains_node("Input"))
+    self.assertEqual(len(graph.nodes), len(self.graph.nodes) - 2)
+
+    # Consumers of all merged constants must be rewired to the shared copy.
+    self.assertIs(graph["Add"].inputs[1].node, merged)
+    self.assertIs(graph["Add_1"].inputs[0].node, merged)
+    self.assertIs(graph["Add_2"].inputs[0].node, merged)
+
+  def test_transform_cse_skips_stateful_and_controlled_ops(self):
+    g = gde.Graph()
+    for name in ["v0", "v1"]:
+      v = g.add_node(name, "VariableV2")
+      v.add_attr("dtype", tf.float32)
+      v.add_attr("shape", tf.TensorShape([2]))
+      # pylint: disable=protected-access
+      v.set_outputs_from_pairs([(tf.float32._as_ref, tf.TensorShape([2]))])
+    anchor = gde.make_const(g, "anchor", np.array([1.], dtype=np.float32))
+    c0 = gde.make_const(g, "c0", np.array([2.], dtype=np.float32))
+    c1 = gde.make_const(g, "c1", np.array([2.], dtype=np.float32))
+    c0.set_control_inputs([anchor])
+    c1.set_control_inputs([anchor])
+
+    transformer = gde.Transformer()
+    transformer.enable_cse = True
+    graph = gde.Graph()
+    _, info = transformer(g, graph, "", "")
+
+    # VariableV2 is stateful and c0/c1 carry control inputs, so none of the
+    # duplicate pairs may be merged.
+    self.assertIsNot(info.transformed(g["v0"]), info.transformed(g["v1"]))
+    self.assertIsNot(info.transformed(g["c0"]), info.transformed(g["c1"]))
+    self.assertEqual(len(graph.nodes), len(g.nodes))
+
   def test_copy_with_input_replacements(self):
     # Original code:
     # with self.graph.as_default():